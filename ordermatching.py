@@ -1,96 +1,165 @@
+import io
+
+import openpyxl
 import streamlit as st
 import pandas as pd
 import altair as alt # type: ignore
+import numpy as np
+
+try:
+    from numba import njit, prange, types # type: ignore
+    from numba.typed import Dict # type: ignore
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
 
 # --- Configuration --- 
 CLIENT_CONFIG = {
     "Crepe Erase": {
-        "order_medium_filter": ['paid_search', 'direct', 'none', 'organic']
+        "order_medium_filter": frozenset({'paid_search', 'direct', 'none', 'organic'})
     },
     "Nutrisystem": {
-        "order_medium_filter": ['cpc', '(none)', 'organic', 'tv', 'null']
+        "order_medium_filter": frozenset({'cpc', '(none)', 'organic', 'tv', 'null'})
     },
     "Smileactives": {
-        "order_medium_filter": ['paid_search', 'direct', 'none', 'organic'] 
+        "order_medium_filter": frozenset({'paid_search', 'direct', 'none', 'organic'})
     }
 }
 
 # --- Functions ---
-def match_orders(client_df: pd.DataFrame, 
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _hash_membership_mask(hashes, lookup_hashes):
+        lookup = Dict.empty(types.uint64, types.uint8)
+        for h in lookup_hashes:
+            lookup[h] = np.uint8(1)
+        out = np.empty(hashes.size, np.bool_)
+        for i in prange(hashes.size):
+            out[i] = hashes[i] in lookup
+        return out
+
+def build_match_mask(hashes: np.ndarray, lookup_hashes: np.ndarray) -> np.ndarray:
+    """Boolean mask of which hashes appear in lookup_hashes, JIT-parallel when numba is available."""
+    if HAS_NUMBA:
+        return _hash_membership_mask(hashes, lookup_hashes)
+    return np.isin(hashes, lookup_hashes)
+
+@st.cache_data(show_spinner=False)
+def match_orders(client_df: pd.DataFrame,
                  blockboard_df: pd.DataFrame, 
-                 client_name: str) -> tuple[int, pd.DataFrame]:
+                 client_name: str) -> tuple[int, pd.DataFrame, pd.DataFrame]:
     """
     Performs order matching based on client-specific filters.
 
     Args:
         client_df (pd.DataFrame): DataFrame containing client order data.
         blockboard_df (pd.DataFrame): DataFrame containing Blockboard order data.
-        client_name (str): Name of the client to apply specific filters. 
+        client_name (str): Name of the client to apply specific filters.
 
     Returns:
-        tuple[int, pd.DataFrame]: A tuple containing the match count and 
-                                    a DataFrame of matched orders.
+        tuple[int, pd.DataFrame, pd.DataFrame]: A tuple containing the match
+                                    count, a DataFrame of matched orders, and
+                                    a DataFrame of matched orders per day.
     """
     
-    filters = CLIENT_CONFIG.get(client_name, {}) 
-    filtered_client_df = client_df[client_df['order_medium'].isin(
-        filters.get("order_medium_filter", [])
-    )]
+    filters = CLIENT_CONFIG.get(client_name, {})
+    allowed_media = filters.get("order_medium_filter", frozenset())
+
+    medium_categories = client_df['order_medium'].cat.categories
+    allowed_codes = np.array([
+        medium_categories.get_loc(medium)
+        for medium in allowed_media if medium in medium_categories
+    ])
+    medium_mask = np.isin(client_df['order_medium'].cat.codes.to_numpy(), allowed_codes)
+    filtered_client_df = client_df.loc[medium_mask]
     
-    client_transaction_ids = filtered_client_df['transaction_id'].astype(str).to_list()
-    client_transaction_ids = [tid.strip() for tid in client_transaction_ids]
+    blockboard_hashes = pd.util.hash_array(blockboard_df['Order ID'].astype(str).to_numpy())
+    client_hashes = pd.util.hash_array(filtered_client_df['transaction_id'].to_numpy())
 
-    blockboard_order_set = set(blockboard_df["Order ID"])
-    match_count = sum(1 for order_id in blockboard_order_set if order_id in client_transaction_ids)
+    mask = build_match_mask(blockboard_hashes, client_hashes)
+    matched_df = blockboard_df.loc[mask]
+    match_count = int(mask.sum())
 
-    matched_rows = [
-        row.to_dict() for index, row in blockboard_df.iterrows()
-        if row['Order ID'] in client_transaction_ids
-    ]
-    return match_count, pd.DataFrame(matched_rows)
+    daily_matches = (
+        matched_df['Date'].dt.floor('D').value_counts().sort_index()
+        .rename_axis('Date').reset_index(name='Matched Orders')
+    )
+    return match_count, matched_df, daily_matches
 
+@st.cache_data(show_spinner=False)
 def load_and_process_data(uploaded_client_file, uploaded_blockboard_file):
     """Loads, filters, and processes client and Blockboard data."""
-    try: 
-        client_df = pd.read_csv(uploaded_client_file)
-        blockboard_df = pd.read_csv(uploaded_blockboard_file)
+    try:
+        blockboard_columns = pd.read_csv(uploaded_blockboard_file, nrows=0).columns
+        uploaded_blockboard_file.seek(0)
+        blockboard_usecols = [
+            column for column in blockboard_columns
+            if column in ('Order ID', 'Date', 'Attribution Pixel', 'Revenue')
+            or column.startswith("Leads")
+        ]
+
+        client_df = pd.read_csv(
+            uploaded_client_file,
+            engine="pyarrow", dtype_backend="pyarrow",
+            usecols=['transaction_id', 'order_medium', 'easternstandardate'],
+            parse_dates=['easternstandardate']
+        )
+        blockboard_df = pd.read_csv(
+            uploaded_blockboard_file,
+            engine="pyarrow", dtype_backend="pyarrow",
+            usecols=blockboard_usecols,
+            dtype={'Order ID': 'string'},
+            parse_dates=['Date']
+        )
     except Exception as e:
         st.error(f"Error loading files: {e}")
         return None, None
 
-    # Blockboard Data Cleaning & Preprocessing
-    blockboard_df['Order ID'] = blockboard_df['Order ID'].astype(str).str.strip()
-    blockboard_df = blockboard_df[~blockboard_df['Order ID'].str.contains("VALUE")]
-    blockboard_df = blockboard_df.drop_duplicates(subset='Order ID', keep='first')
-    blockboard_df = blockboard_df[~blockboard_df['Attribution Pixel'].str.contains("landing|home", case=False, na=False)]
+    # Client Data Cleaning & Preprocessing
+    client_df['transaction_id'] = client_df['transaction_id'].astype('string').str.strip()
+    client_df['order_medium'] = client_df['order_medium'].astype('category')
 
+    # Blockboard Data Cleaning & Preprocessing
+    blockboard_df['Order ID'] = blockboard_df['Order ID'].str.strip()
+    valid_rows = (
+        ~blockboard_df['Order ID'].str.contains("VALUE", regex=False)
+        & ~blockboard_df['Order ID'].duplicated(keep='first')
+        & ~blockboard_df['Attribution Pixel'].str.contains("landing|home", case=False, na=False)
+    )
+    blockboard_df = blockboard_df.loc[valid_rows]
 
-    for column in blockboard_df.columns:
-        if column.startswith("Leads"):
-            blockboard_df.loc[:, column] = blockboard_df[column].clip(upper=1)
 
-    # --- Date Handling --- 
-    try: 
-        client_df['easternstandardate'] = pd.to_datetime(client_df['easternstandardate'])
-        blockboard_df['Date'] = pd.to_datetime(blockboard_df['Date'])
-    except KeyError as e:
-        st.error(f"Date column not found: {e}")
-        return None, None 
+    blockboard_df['Order ID'] = blockboard_df['Order ID'].astype('category')
 
-    # --- Sorting ---
-    client_df = client_df.sort_values(by='easternstandardate')
-    blockboard_df = blockboard_df.sort_values(by='Date')   
+    leads_cols = blockboard_df.columns[blockboard_df.columns.str.startswith("Leads")]
+    blockboard_df[leads_cols] = blockboard_df[leads_cols].clip(upper=1)
 
     return client_df, blockboard_df
 
-def create_matched_orders_chart(matched_df: pd.DataFrame, date_column='Date'):
-    """Creates an Altair chart of matched orders by day."""
-    matched_df['Date'] = pd.to_datetime(matched_df['Date'], errors='coerce')
-    matched_df.dropna(subset=['Date'], inplace=True)
-    
-    daily_matches = matched_df[date_column].dt.date.value_counts().reset_index()
-    daily_matches.columns = [date_column, 'Matched Orders']
-
+@st.cache_data(
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=False).values.tobytes()}
+)
+def build_excel_bytes(all_df: pd.DataFrame, matched_df: pd.DataFrame) -> bytes:
+    """Builds the downloadable Excel workbook (All Orders + Matched Orders) as bytes."""
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, sheet_df in (("All Orders", all_df),
+                                 ("Matched Orders", matched_df)):
+        sheet_df = sheet_df.sort_values(by='Date')
+        sheet_df = sheet_df.assign(Date=sheet_df['Date'].dt.date)
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.column_dimensions['A'].width = 12 # Assuming date is in the first column 'A'
+        worksheet.column_dimensions['A'].number_format = 'yyyy-mm-dd'
+        worksheet.append(list(sheet_df.columns))
+        for row in sheet_df.itertuples(index=False, name=None):
+            worksheet.append(row)
+
+    excel_buffer = io.BytesIO()
+    workbook.save(excel_buffer)
+    return excel_buffer.getvalue()
+
+def create_matched_orders_chart(daily_matches: pd.DataFrame, date_column='Date'):
+    """Creates an Altair chart of matched orders by day from precomputed daily counts."""
     chart = alt.Chart(daily_matches).mark_line().encode(
         x=alt.X(date_column, axis=alt.Axis(title='Date', labelAngle=-45)),
         y=alt.Y('Matched Orders', axis=alt.Axis(title='Number of Matched Orders')),
@@ -117,20 +186,25 @@ cpa = st.number_input("Enter CPA:", value=0.00)
 order_goal = st.number_input("Enter IO Order Goal:", value=0, step=1)
 
 if uploaded_client_file and uploaded_blockboard_file:
-    client_df, blockboard_df = load_and_process_data(
-        uploaded_client_file, uploaded_blockboard_file
-    )
+    upload_key = (uploaded_client_file.name, uploaded_client_file.size,
+                  uploaded_blockboard_file.name, uploaded_blockboard_file.size)
+    if st.session_state.get('upload_key') != upload_key:
+        st.session_state['loaded_dfs'] = load_and_process_data(
+            uploaded_client_file, uploaded_blockboard_file
+        )
+        st.session_state['upload_key'] = upload_key
+    client_df, blockboard_df = st.session_state['loaded_dfs']
 
     if client_df is not None and blockboard_df is not None: 
-        num_blockboard_orders_unique = len(blockboard_df['Order ID'].unique())
-        num_blockboard_orders = len(blockboard_df['Order ID'])
+        num_blockboard_orders_unique = blockboard_df['Order ID'].nunique()
+        num_blockboard_orders = len(blockboard_df)
 
         if client_selection:
-            match_count, matched_df = match_orders(
+            match_count, matched_df, daily_matches = match_orders(
                 client_df, blockboard_df, client_selection
             )
 
-            st.altair_chart(create_matched_orders_chart(matched_df), use_container_width=True)
+            st.altair_chart(create_matched_orders_chart(daily_matches), use_container_width=True)
 
             revenue = cpa * match_count
             total_cost = blockboard_spend
@@ -151,29 +225,10 @@ if uploaded_client_file and uploaded_blockboard_file:
             matched_df['Revenue'] = pd.to_numeric(matched_df['Revenue'], errors='coerce')
 
             # --- Excel Output ---
-            output_excel_file = "blockboard_data.xlsx" 
-
-            with pd.ExcelWriter(output_excel_file, engine='xlsxwriter') as writer:
-                blockboard_df['Date'] = blockboard_df['Date'].dt.date 
-                matched_df['Date'] = matched_df['Date'].dt.date 
-
-                blockboard_df.to_excel(writer, sheet_name="All Orders", index=False)
-                matched_df.to_excel(writer, sheet_name="Matched Orders", index=False)
-
-                # --- Format Date Columns ---
-                workbook = writer.book
-                date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'}) 
-
-                worksheet1 = writer.sheets['All Orders']
-                worksheet1.set_column('A:A', 12, date_format) # Assuming date is in the first column 'A'
-
-                worksheet2 = writer.sheets['Matched Orders']
-                worksheet2.set_column('A:A', 12, date_format) 
-
             st.download_button(
                 label="Download Blockboard Data (Excel)",
-                data=open(output_excel_file, 'rb').read(), 
-                file_name=output_excel_file,
+                data=build_excel_bytes(blockboard_df, matched_df),
+                file_name="blockboard_data.xlsx",
                 mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             ) 
 